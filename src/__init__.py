@@ -5,7 +5,9 @@
     db       — работа с PostgreSQL (подключение, миграции, запросы);
     load_data — импорт данных из исходного JSON;
     nlp      — обращение к LLM для генерации SQL;
+    cache    — кеш сгенерированных SQL (точный и семантический);
+    profiling — учёт времени выполнения горячих функций;
     bot      — точка входа для телеграм‑бота.
 """
 
-__all__ = ["config", "db", "load_data", "nlp", "bot"]
\ No newline at end of file
+__all__ = ["config", "db", "load_data", "nlp", "cache", "profiling", "bot"]
\ No newline at end of file
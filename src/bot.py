@@ -7,69 +7,187 @@ aiogram v3.5.0: polling, без state.
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import logging
+import signal
 
+import asyncpg
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.filters import Command, CommandStart
 from aiogram.types import Message
 
 from .config import settings
-from .db import init_pool, close_pool, fetchval, run_migrations
-from .nlp import query_to_sql, sanitize_sql
+from .db import init_pool, close_pool, fetchval_read, run_migrations
+from .nlp import (
+    check_prompt_prefix,
+    close_llm_clients,
+    query_to_sql,
+    sanitize_sql,
+    sql_cache,
+)
+from .profiling import format_stats
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Telegram пропускает от бота не больше ~30 сообщений в секунду
+SEND_RATE = 30
+SEND_INTERVAL = 1 / SEND_RATE
+
+# Ошибки, означающие, что неверен сам SQL (или испорчена запись кеша), а не
+# что недоступна база: только после них SQL удаляется из кеша.
+_BAD_SQL_ERRORS = (
+    asyncpg.PostgresSyntaxError,
+    asyncpg.UndefinedColumnError,
+    asyncpg.UndefinedTableError,
+    asyncpg.DataError,
+    ValueError,
+)
+
+
+async def _send(
+    bot: Bot,
+    outbound: asyncio.Queue[tuple[int, str]],
+    slots: asyncio.Semaphore,
+    chat_id: int,
+    text: str,
+) -> None:
+    """Отправляет один ответ и освобождает слот и элемент очереди."""
+    try:
+        try:
+            await bot.send_message(chat_id, text)
+        except TelegramRetryAfter as e:
+            # Лимит всё же превышен — ждём, сколько попросил Telegram
+            await asyncio.sleep(e.retry_after)
+            await bot.send_message(chat_id, text)
+    except Exception:
+        logger.exception("Failed to send message to chat %s", chat_id)
+    finally:
+        slots.release()
+        outbound.task_done()
+
+
+async def _sender(bot: Bot, outbound: asyncio.Queue[tuple[int, str]]) -> None:
+    """Отправляет ответы из очереди с темпом не выше лимита Telegram.
+
+    Обработчики сообщений только кладут ответ в очередь и сразу
+    освобождаются; при всплеске нагрузки ждёт эта задача, а не polling.
+    Каждая отправка идёт отдельной задачей (не больше SEND_RATE
+    одновременно), а интервал выдерживается только между их запусками,
+    поэтому задержка ответа Telegram не снижает пропускную способность.
+    """
+    slots = asyncio.Semaphore(SEND_RATE)
+    pending: set[asyncio.Task] = set()
+    try:
+        while True:
+            chat_id, text = await outbound.get()
+            await slots.acquire()
+            task = asyncio.create_task(_send(bot, outbound, slots, chat_id, text))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            await asyncio.sleep(SEND_INTERVAL)
+    finally:
+        for task in pending:
+            task.cancel()
+
 
 async def main() -> None:
+    if settings.bot_debug:
+        # Режим отладки asyncio: предупреждения о колбэках дольше 50 мс
+        # помогают найти случайные блокирующие вызовы в event loop.
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = 0.05
+        # kill -USR1 <pid> — вывести в лог время горячих функций
+        if hasattr(signal, "SIGUSR1"):
+            loop.add_signal_handler(
+                signal.SIGUSR1, lambda: logger.info("Profile:\n%s", format_stats())
+            )
+
     # БД + миграции
     await init_pool()
     await run_migrations()
+    # Кеш SQL (и модель эмбеддингов) загружаем один раз при старте
+    await sql_cache.open()
+    # tiktoken может скачивать словарь по сети — не в event loop
+    await asyncio.to_thread(check_prompt_prefix)
 
    
     bot = Bot(token=settings.bot_token)
     dp = Dispatcher()
 
+    outbound: asyncio.Queue[tuple[int, str]] = asyncio.Queue(maxsize=1000)
+    sender_task = asyncio.create_task(_sender(bot, outbound))
+
     @dp.message(CommandStart())
     async def start(message: Message):
-        await message.answer(
-        "Этот бот считает метрики по базе видеоконтента.\n"
-        "Задайте вопрос на русском языке, например:\n"
-        "• Сколько всего видео есть в системе?\n"
-        "• Сколько видео у креатора с id 42 вышло с 1 ноября 2025 по 5 ноября 2025?\n"
-        "• На сколько просмотров в сумме выросли все видео 28 ноября 2025?"
-    )
+        await outbound.put((
+            message.chat.id,
+            "Этот бот считает метрики по базе видеоконтента.\n"
+            "Задайте вопрос на русском языке, например:\n"
+            "• Сколько всего видео есть в системе?\n"
+            "• Сколько видео у креатора с id 42 вышло с 1 ноября 2025 по 5 ноября 2025?\n"
+            "• На сколько просмотров в сумме выросли все видео 28 ноября 2025?",
+        ))
         
 
+    if settings.bot_debug:
+        @dp.message(Command("stats"))
+        async def stats(message: Message):
+            await outbound.put((message.chat.id, format_stats()))
+
     @dp.message(F.text)
     async def handle(message: Message):
         question = (message.text or "").strip()
         if not question:
-            await message.answer("Пустой запрос. Напиши вопрос текстом.")
+            await outbound.put((message.chat.id, "Пустой запрос. Напиши вопрос текстом."))
             return
 
         try:
-            sql = await query_to_sql(question)
+            sql, params = await query_to_sql(question)
             sql = sanitize_sql(sql)
 
-            logger.info("Generated SQL: %s", sql)
+            logger.info("Generated SQL: %s %s", sql, params)
 
-            result = await fetchval(sql)
-            await message.answer(str(result if result is not None else 0))
+            result = await fetchval_read(sql, *params)
+            await outbound.put((message.chat.id, str(result if result is not None else 0)))
 
-        except Exception:
+        except Exception as e:
             logger.exception("Error processing query: %s", question)
-            await message.answer(
+            if isinstance(e, _BAD_SQL_ERRORS):
+                # Неверный SQL не должен отдаваться из кеша повторно
+                await sql_cache.invalidate(question)
+            await outbound.put((
+                message.chat.id,
                 "Ошибка при обработке запроса.\n"
-                "Попробуй переформулировать вопрос (или проверь, что данные загружены)."
-            )
+                "Попробуй переформулировать вопрос (или проверь, что данные загружены).",
+            ))
 
     try:
-        await dp.start_polling(bot)
+        # Сессию бота закрываем сами: она нужна, чтобы дослать ответы из очереди
+        await dp.start_polling(bot, close_bot_session=False)
     finally:
+        # Даём отправить уже подготовленные ответы, затем останавливаем отправителя
+        try:
+            await asyncio.wait_for(outbound.join(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d unsent replies", outbound.qsize())
+        sender_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await sender_task
+        await bot.session.close()
+        await close_llm_clients()
+        await sql_cache.close()
         await close_pool()
 
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+    except ImportError:  # uvloop недоступен, например, на Windows
+        pass
+    else:
+        uvloop.install()
     asyncio.run(main())
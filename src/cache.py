@@ -0,0 +1,327 @@
+"""Кеш сгенерированных LLM SQL‑запросов.
+
+Двухуровневый кеш, ключом которого служит нормализованный текст вопроса:
+
+1) точное совпадение — хеш blake2b от нормализованного вопроса, хранится
+   в словаре в памяти и в SQLite‑файле (переживает перезапуск бота);
+2) семантическое совпадение — эмбеддинг вопроса сравнивается со всеми
+   закешированными эмбеддингами, при косинусной близости не ниже порога
+   возвращается ранее сгенерированный SQL.
+
+Семантический уровень требует `sentence-transformers`
+(requirements-semantic.txt) и модели в SEMANTIC_CACHE_MODEL; если пакет не
+установлен, модель не задана или не загрузилась, работает только точный
+уровень.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import aiosqlite
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # семантический уровень опционален
+    SentenceTransformer = None
+
+
+logger = logging.getLogger(__name__)
+
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_SPACES_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\d+")
+
+# Версия схемы SQLite‑файла. Это кеш, поэтому при смене схемы старая таблица
+# просто пересоздаётся.
+_SCHEMA_VERSION = 3
+
+# Слова, от которых зависит смысл аналитического вопроса, но которые почти
+# не меняют эмбеддинг: месяц, метрика, сравнение, агрегат, относительная
+# дата, объект подсчёта. Семантическое попадание принимается, только если
+# они (и все числа) совпадают.
+_KEY_STEMS = (
+    # месяцы
+    "январ", "феврал", "март", "апрел", "мая", "май", "мае", "июн", "июл",
+    "август", "сентябр", "октябр", "ноябр", "декабр",
+    # метрики
+    "просмотр", "лайк", "коммент", "жалоб",
+    # сравнения
+    "больш", "меньш", "более", "менее", "выше", "ниже",
+    # агрегаты
+    "максимальн", "минимальн", "средн", "сумм", "разн",
+    # относительные даты
+    "сегодня", "вчера", "недел",
+    # объект подсчёта
+    "креатор", "видео",
+)
+
+
+def normalize_question(question: str) -> str:
+    """Приводит вопрос к каноническому виду: нижний регистр, без пунктуации,
+    пробелы схлопнуты."""
+    text = _PUNCT_RE.sub(" ", question.lower().replace("ё", "е"))
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def question_signature(normalized: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Числа и ключевые слова вопроса, которые обязаны совпасть при
+    семантическом попадании в кеш."""
+    stems = tuple(
+        stem
+        for word in normalized.split()
+        for stem in _KEY_STEMS
+        if word.startswith(stem)
+    )
+    return tuple(_DIGITS_RE.findall(normalized)), stems
+
+
+def question_hash(normalized: str) -> str:
+    """Ключ точного уровня кеша."""
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SemanticSQLCache:
+    """Кеш «вопрос -> SQL» с точным и семантическим уровнями.
+
+    Экземпляр нужно открыть (`open`) до использования и закрыть (`close`)
+    при остановке. Повторяющиеся одновременные вопросы схлопываются в один
+    вызов LLM (single-flight).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        model_name: Optional[str] = None,
+        threshold: float = 0.92,
+    ) -> None:
+        self.path = path
+        self.model_name = model_name
+        self.threshold = threshold
+
+        self._db: Optional[aiosqlite.Connection] = None
+        self._model: Any = None
+        self._exact: dict[str, str] = {}
+        # Ключ копии, сохранённой при семантическом попадании -> ключ записи,
+        # чей SQL был переиспользован
+        self._sources: dict[str, str] = {}
+        # Параллельные массивы для семантического уровня
+        self._keys: list[str] = []
+        self._questions: list[str] = []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._locks_guard = asyncio.Lock()
+
+    async def open(self) -> None:
+        """Открывает SQLite‑файл, загружает модель эмбеддингов и прогревает кеш."""
+        self._db = await aiosqlite.connect(self.path)
+        async with self._db.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        if version != _SCHEMA_VERSION:
+            await self._db.execute("DROP TABLE IF EXISTS sql_cache")
+            await self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        await self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sql_cache (
+                q_hash TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                embedding BLOB,
+                model TEXT,
+                source TEXT,
+                ts REAL NOT NULL
+            )
+            """
+        )
+        await self._db.commit()
+
+        if self.model_name and SentenceTransformer is not None:
+            # Загрузка модели — блокирующая операция, уводим её в поток
+            try:
+                self._model = await asyncio.to_thread(SentenceTransformer, self.model_name)
+            except Exception:
+                # Модель не скачалась или не загрузилась — бот работает без неё
+                logger.exception(
+                    "Не удалось загрузить модель %s, семантический кеш отключён",
+                    self.model_name,
+                )
+        elif self.model_name:
+            logger.warning(
+                "sentence-transformers не установлен, семантический кеш отключён"
+            )
+
+        # Эмбеддинги другой модели (в том числе другой размерности) с текущими
+        # несравнимы: такие записи остаются только в точном уровне.
+        vectors: list[np.ndarray] = []
+        async with self._db.execute(
+            "SELECT q_hash, question, sql, embedding, model, source "
+            "FROM sql_cache ORDER BY ts"
+        ) as cursor:
+            async for q_hash, question, sql, embedding, model, source in cursor:
+                self._exact[q_hash] = sql
+                if source is not None:
+                    self._sources[q_hash] = source
+                if (
+                    self._model is not None
+                    and embedding is not None
+                    and model == self.model_name
+                ):
+                    vector = np.frombuffer(embedding, dtype=np.float32)
+                    if vectors and vector.shape != vectors[0].shape:
+                        continue
+                    self._keys.append(q_hash)
+                    self._questions.append(question)
+                    vectors.append(vector)
+        if vectors:
+            self._matrix = np.vstack(vectors)
+
+        logger.info("SQL cache loaded: %d entries", len(self._exact))
+
+    async def close(self) -> None:
+        """Закрывает SQLite‑соединение."""
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def get_or_create(
+        self,
+        question: str,
+        factory: Callable[[str], Awaitable[str]],
+    ) -> str:
+        """Возвращает SQL из кеша или генерирует его через `factory`."""
+        normalized = normalize_question(question)
+        key = question_hash(normalized)
+
+        sql = self._exact.get(key)
+        if sql is not None:
+            logger.info("SQL cache hit (exact)")
+            return sql
+
+        async with self._locks_guard:
+            lock = self._locks.setdefault(key, asyncio.Lock())
+
+        try:
+            async with lock:
+                # Пока ждали блокировку, тот же вопрос мог быть обработан
+                sql = self._exact.get(key)
+                if sql is not None:
+                    logger.info("SQL cache hit (exact)")
+                    return sql
+
+                embedding = await self._embed(normalized)
+                source = self._lookup_similar(normalized, embedding)
+                if source is not None:
+                    logger.info("SQL cache hit (semantic)")
+                    sql = self._exact[source]
+                else:
+                    sql = await factory(question)
+
+                await self._store(key, normalized, sql, embedding, source)
+                return sql
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+
+    async def invalidate(self, question: str) -> None:
+        """Удаляет из кеша SQL, закешированный для вопроса.
+
+        Вызывается, когда закешированный SQL упал при выполнении, чтобы
+        следующий такой же вопрос снова ушёл в LLM. Удаляется запись, из
+        которой этот SQL был получен, и её копии, сохранённые при
+        семантических попаданиях; независимо сгенерированные записи с тем же
+        SQL остаются.
+        """
+        key = question_hash(normalize_question(question))
+        if key not in self._exact:
+            return
+
+        root = self._sources.get(key, key)
+        stale = {root} | {k for k, src in self._sources.items() if src == root}
+        for k in stale:
+            self._exact.pop(k, None)
+            self._sources.pop(k, None)
+
+        keep = [i for i, k in enumerate(self._keys) if k not in stale]
+        if len(keep) != len(self._keys):
+            self._keys = [self._keys[i] for i in keep]
+            self._questions = [self._questions[i] for i in keep]
+            self._matrix = self._matrix[keep]
+
+        if self._db is not None:
+            await self._db.execute(
+                "DELETE FROM sql_cache WHERE q_hash = ? OR source = ?", (root, root)
+            )
+            await self._db.commit()
+        logger.info("SQL cache invalidated: %d entries", len(stale))
+
+    async def _embed(self, normalized: str) -> Optional[np.ndarray]:
+        if self._model is None:
+            return None
+        vector = await asyncio.to_thread(
+            self._model.encode, normalized, normalize_embeddings=True
+        )
+        return np.asarray(vector, dtype=np.float32)
+
+    def _lookup_similar(
+        self, normalized: str, embedding: Optional[np.ndarray]
+    ) -> Optional[str]:
+        """Возвращает ключ записи, чей SQL подходит к вопросу, или None."""
+        if embedding is None or not self._keys:
+            return None
+        # Векторы нормированы, поэтому скалярное произведение = косинус
+        scores = self._matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        # Вопросы "28 ноября" и "28 декабря" или про лайки и про просмотры
+        # почти неотличимы для эмбеддингов, поэтому числа и ключевые слова
+        # (_KEY_STEMS) в вопросах обязаны совпадать.
+        if question_signature(self._questions[best]) != question_signature(normalized):
+            return None
+        # Копия ссылается на исходную запись, чтобы invalidate нашёл всю группу
+        key = self._keys[best]
+        return self._sources.get(key, key)
+
+    async def _store(
+        self,
+        key: str,
+        normalized: str,
+        sql: str,
+        embedding: Optional[np.ndarray],
+        source: Optional[str] = None,
+    ) -> None:
+        self._exact[key] = sql
+        if source is not None:
+            self._sources[key] = source
+        if embedding is not None:
+            self._keys.append(key)
+            self._questions.append(normalized)
+            if self._matrix.size:
+                self._matrix = np.vstack([self._matrix, embedding])
+            else:
+                self._matrix = embedding.reshape(1, -1)
+
+        if self._db is None:
+            return
+        await self._db.execute(
+            "INSERT OR REPLACE INTO sql_cache "
+            "(q_hash, question, sql, embedding, model, source, ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                normalized,
+                sql,
+                embedding.tobytes() if embedding is not None else None,
+                self.model_name if embedding is not None else None,
+                source,
+                time.time(),
+            ),
+        )
+        await self._db.commit()
@@ -9,27 +9,47 @@ from __future__ import annotations
 
 from functools import lru_cache
 # В pydantic v2 класс BaseSettings переехал в пакет pydantic_settings.
-from pydantic_settings import BaseSettings
-from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
-    bot_token: str = Field(..., env="BOT_TOKEN")
-    database_url: str = Field(..., env="DATABASE_URL")
-    openai_api_key: str = Field(..., env="OPENAI_API_KEY")
-    llm_model: str = Field("gpt-3.5-turbo", env="LLM_MODEL")
-    llm_provider: str = Field("openai", env="LLM_PROVIDER")
+    bot_token: str
+    database_url: str
+    # Подключение для запросов бота под ролью только с правом SELECT (см.
+    # README). Если не задано, используется DATABASE_URL.
+    database_reader_url: str | None = None
+    db_pool_max: int = 8
+    # Максимальное время аналитического запроса бота, секунд
+    db_query_timeout: float = 10.0
+    openai_api_key: str
+    llm_model: str = "gpt-4o-mini"
+    # Генерация SQL должна быть детерминированной
+    llm_temperature: float = 0.0
+    llm_top_p: float = 1.0
+    llm_provider: str = "openai"
+    bot_debug: bool = False
+
+    # Кеш сгенерированных SQL. Семантический уровень включается, только если
+    # задана модель (например, paraphrase-multilingual-MiniLM-L12-v2) и
+    # установлены зависимости из requirements-semantic.txt.
+    llm_cache_path: str = "llm_cache.sqlite3"
+    semantic_cache_model: str | None = None
+    semantic_cache_threshold: float = 0.92
 
     # Параметры GigaChat. Если вы используете GigaChat, заполните их в .env
-    gigachat_credentials: str | None = Field(None, env="GIGACHAT_CREDENTIALS")
-    gigachat_scope: str | None = Field(None, env="GIGACHAT_SCOPE")
-    gigachat_model: str | None = Field(None, env="GIGACHAT_MODEL")
-    gigachat_ca_bundle_file: str | None = Field(None, env="GIGACHAT_CA_BUNDLE_FILE")
-    gigachat_verify_ssl_certs: bool | None = Field(None, env="GIGACHAT_VERIFY_SSL_CERTS")
-
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+    gigachat_credentials: str | None = None
+    gigachat_scope: str | None = None
+    gigachat_model: str | None = None
+    gigachat_ca_bundle_file: str | None = None
+    gigachat_verify_ssl_certs: bool | None = None
+
+    # Имена переменных окружения совпадают с именами полей без учёта
+    # регистра (BOT_TOKEN -> bot_token), поэтому алиасы не нужны.
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        frozen=True,
+    )
 
 
 @lru_cache
@@ -19,14 +19,47 @@ from __future__ import annotations
 
 import asyncio
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import Any, Iterable, Iterator, List, Optional
 from datetime import datetime
 
-import ujson
+import asyncpg
+import orjson
 
 from . import db
 
 
+# Сколько строк (видео + снапшоты) накапливаем перед отправкой пачки в базу
+CHUNK_SIZE = 10_000
+
+VIDEO_COLUMNS = [
+    "id", "creator_id", "video_created_at", "views_count", "likes_count",
+    "comments_count", "reports_count", "created_at", "updated_at",
+]
+
+SNAPSHOT_COLUMNS = [
+    "id", "video_id", "views_count", "likes_count", "comments_count",
+    "reports_count", "delta_views_count", "delta_likes_count",
+    "delta_comments_count", "delta_reports_count",
+    "created_at", "updated_at",
+]
+
+# Строки сначала заливаются через COPY во временные таблицы (без проверок
+# конфликтов и без WAL), а затем переносятся в основные одним запросом.
+CREATE_STAGE_SQL = """
+    CREATE TEMP TABLE videos_stage
+        (LIKE videos INCLUDING DEFAULTS) ON COMMIT DROP;
+    CREATE TEMP TABLE video_snapshots_stage
+        (LIKE video_snapshots INCLUDING DEFAULTS) ON COMMIT DROP;
+"""
+
+MERGE_STAGE_SQL = """
+    INSERT INTO videos SELECT * FROM videos_stage
+    ON CONFLICT (id) DO NOTHING;
+    INSERT INTO video_snapshots SELECT * FROM video_snapshots_stage
+    ON CONFLICT (id) DO NOTHING;
+"""
+
+
 def parse_dt(value: Any) -> Optional[datetime]:
     """Парсит ISO‑дату в datetime для asyncpg (TIMESTAMPTZ ожидает datetime)."""
     if value is None:
@@ -39,6 +72,8 @@ def parse_dt(value: Any) -> Optional[datetime]:
             return None
         # поддержка 'Z'
         s = s.replace("Z", "+00:00")
+        # fromisoformat реализован на C: разбор срезами строки на Python
+        # оказался примерно в 10 раз медленнее, поэтому оставляем его.
         try:
             return datetime.fromisoformat(s)
         except ValueError:
@@ -67,6 +102,55 @@ def to_int(value: Any, default: int = 0) -> int:
     return default
 
 
+def iter_rows(data: Iterable[Any]) -> Iterator[tuple[str, tuple]]:
+    """Лениво превращает список видео в строки для таблиц.
+
+    Отдаёт пары ("videos", row) и ("snapshots", row); снапшоты видео идут
+    сразу после строки самого видео. Строки создаются по одной, поэтому
+    в памяти одновременно живёт не больше одной пачки.
+    """
+    for video in data:
+        if not isinstance(video, dict):
+            continue
+
+        vid = video.get("id")  # UUID or string
+
+        yield "videos", (
+            vid,
+            video.get("creator_id"),  # possibly string or int
+            parse_dt(video.get("video_created_at")),
+            to_int(video.get("views_count")),
+            to_int(video.get("likes_count")),
+            to_int(video.get("comments_count")),
+            to_int(video.get("reports_count")),
+            parse_dt(video.get("created_at")),
+            parse_dt(video.get("updated_at")),
+        )
+
+        # Снапшоты
+        snaps = video.get("snapshots") or ()
+        if not isinstance(snaps, list):
+            continue
+        for snap in snaps:
+            if not isinstance(snap, dict):
+                continue
+
+            yield "snapshots", (
+                snap.get("id"),  # UUID or string
+                vid,  # video_id
+                to_int(snap.get("views_count")),
+                to_int(snap.get("likes_count")),
+                to_int(snap.get("comments_count")),
+                to_int(snap.get("reports_count")),
+                to_int(snap.get("delta_views_count")),
+                to_int(snap.get("delta_likes_count")),
+                to_int(snap.get("delta_comments_count")),
+                to_int(snap.get("delta_reports_count")),
+                parse_dt(snap.get("created_at")),
+                parse_dt(snap.get("updated_at")),
+            )
+
+
 async def load_data(json_path: str) -> None:
     path = Path(json_path)
     if not path.exists():
@@ -77,9 +161,8 @@ async def load_data(json_path: str) -> None:
     await db.run_migrations()
     assert db.pool is not None
 
-    # Читаем JSON
-    with path.open("rb") as f:
-        data = ujson.load(f)
+    # Читаем JSON (байты файла сразу освобождаются после разбора)
+    data = orjson.loads(await asyncio.to_thread(path.read_bytes))
 
     # Поддержка формата { "videos": [ ... ] }
     if isinstance(data, dict) and "videos" in data and isinstance(data["videos"], list):
@@ -90,96 +173,46 @@ async def load_data(json_path: str) -> None:
 
     videos_rows: List[tuple] = []
     snapshots_rows: List[tuple] = []
+    total_videos = 0
+    total_snapshots = 0
 
-    for video in data:
-        if not isinstance(video, dict):
-            continue
-
-        vid = video.get("id")  # UUID or string
-        creator_id = video.get("creator_id")  # possibly string or int
-
-        video_created_at = parse_dt(video.get("video_created_at"))
-        created_at = parse_dt(video.get("created_at"))
-        updated_at = parse_dt(video.get("updated_at"))
-
-        views_count = to_int(video.get("views_count"))
-        likes_count = to_int(video.get("likes_count"))
-        comments_count = to_int(video.get("comments_count"))
-        reports_count = to_int(video.get("reports_count"))
-
-        videos_rows.append(
-            (
-                vid,
-                creator_id,
-                video_created_at,
-                views_count,
-                likes_count,
-                comments_count,
-                reports_count,
-                created_at,
-                updated_at,
+    async def flush(conn: asyncpg.Connection) -> None:
+        if videos_rows:
+            await conn.copy_records_to_table(
+                "videos_stage", records=videos_rows, columns=VIDEO_COLUMNS
             )
-        )
+        if snapshots_rows:
+            await conn.copy_records_to_table(
+                "video_snapshots_stage", records=snapshots_rows, columns=SNAPSHOT_COLUMNS
+            )
+        videos_rows.clear()
+        snapshots_rows.clear()
 
-        # Снапшоты
-        snaps = video.get("snapshots") or []
-        if isinstance(snaps, list):
-            for snap in snaps:
-                if not isinstance(snap, dict):
-                    continue
-
-                snapshots_rows.append(
-                    (
-                        snap.get("id"),  # UUID or string
-                        vid,  # video_id
-                        to_int(snap.get("views_count")),
-                        to_int(snap.get("likes_count")),
-                        to_int(snap.get("comments_count")),
-                        to_int(snap.get("reports_count")),
-                        to_int(snap.get("delta_views_count")),
-                        to_int(snap.get("delta_likes_count")),
-                        to_int(snap.get("delta_comments_count")),
-                        to_int(snap.get("delta_reports_count")),
-                        parse_dt(snap.get("created_at")),
-                        parse_dt(snap.get("updated_at")),
-                    )
-                )
-
-    if not videos_rows:
-        print("Нет данных для загрузки (videos_rows пуст). Проверь JSON.")
-        return
-
-    # Вставка в транзакции
+    # Вставка в транзакции: COPY пачками по CHUNK_SIZE строк в staging‑таблицы
     async with db.pool.acquire() as conn:
         async with conn.transaction():
-            await conn.executemany(
-                """
-                INSERT INTO videos (
-                    id, creator_id, video_created_at, views_count, likes_count,
-                    comments_count, reports_count, created_at, updated_at
-                ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9)
-                ON CONFLICT (id) DO NOTHING
-                """,
-                videos_rows,
-            )
+            await conn.execute(CREATE_STAGE_SQL)
+
+            for table, row in iter_rows(data):
+                if table == "videos":
+                    videos_rows.append(row)
+                    total_videos += 1
+                else:
+                    snapshots_rows.append(row)
+                    total_snapshots += 1
+
+                if len(videos_rows) + len(snapshots_rows) >= CHUNK_SIZE:
+                    await flush(conn)
+
+            if not total_videos:
+                print("Нет данных для загрузки (videos_rows пуст). Проверь JSON.")
+                return
+
+            await flush(conn)
+            # Видео переносим раньше снапшотов из-за внешнего ключа video_id
+            await conn.execute(MERGE_STAGE_SQL)
 
-            if snapshots_rows:
-                await conn.executemany(
-                    """
-                    INSERT INTO video_snapshots (
-                        id, video_id, views_count, likes_count, comments_count,
-                        reports_count, delta_views_count, delta_likes_count,
-                        delta_comments_count, delta_reports_count,
-                        created_at, updated_at
-                    ) VALUES (
-                        $1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12
-                    )
-                    ON CONFLICT (id) DO NOTHING
-                    """,
-                    snapshots_rows,
-                )
-
-    print(f"Загружено {len(videos_rows)} видео и {len(snapshots_rows)} снапшотов")
+    print(f"Загружено {total_videos} видео и {total_snapshots} снапшотов")
 
 
 def main() -> None:
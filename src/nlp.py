@@ -5,37 +5,89 @@
 - gigachat (по умолчанию в проекте)
 - openai (опционально)
 
-Возвращает ОДИН SQL‑запрос, который отдаёт ОДНО числовое значение.
+Возвращает ОДИН SQL‑запрос, который отдаёт ОДНО числовое значение, и
+список параметров для него ($1, $2, ...).
 """
 
 from __future__ import annotations
 
+import asyncio
+import logging
 import re
+from datetime import date, datetime
+from typing import Any, Callable, Optional
 
-import openai
+import orjson
+from openai import AsyncOpenAI
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
 
+from .cache import SemanticSQLCache
 from .config import settings
+from .profiling import aioprof
 
 
-import re
+logger = logging.getLogger(__name__)
 
 UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
 
+# Регулярки для sanitize_sql компилируются один раз при импорте модуля
+_FENCE_OPEN = re.compile(r"^```(?:sql)?\s*", re.IGNORECASE)
+_FENCE_CLOSE = re.compile(r"\s*```$")
+_BACKTICKS = re.compile(r"^`(.*)`$", re.DOTALL)
+_PREFIX = re.compile(r"^(SQL|Ответ)\s*:\s*", re.IGNORECASE)
+_CREATOR = re.compile(r"creator_id\s*=\s*'([^']+)'", re.IGNORECASE)
+
+# Первые символы, с которых может начинаться префикс "SQL:" / "Ответ:"
+_PREFIX_FIRST_CHARS = frozenset("SsОо")
+
+
+def _is_uuid(s: str) -> bool:
+    """Быстрая проверка формата UUID без регулярного выражения.
+
+    `UUID_RE` оставлен для внешнего кода.
+    """
+    if len(s) != 36 or not (s[8] == s[13] == s[18] == s[23] == "-"):
+        return False
+    try:
+        # fromhex пропускает пробелы между байтами, поэтому сверяем длину
+        return len(bytes.fromhex(s[:8] + s[9:13] + s[14:18] + s[19:23] + s[24:])) == 16
+    except ValueError:
+        return False
+
+
+def _repl_creator(m: re.Match) -> str:
+    # Если встречается creator_id = 'что-то' и это НЕ UUID -> сравниваем как текст
+    val = m.group(1)
+    if _is_uuid(val):
+        return f"creator_id = '{val}'"
+    return f"creator_id::text = '{val}'"
+
+
 def sanitize_sql(sql: str) -> str:
     sql = sql.strip()
 
-    # убрать ```sql ``` обёртки
-    sql = re.sub(r"^```(?:sql)?\s*", "", sql, flags=re.IGNORECASE)
-    sql = re.sub(r"\s*```$", "", sql)
+    # Быстрый путь: модель вернула чистый SELECT/WITH без обёрток и с не
+    # более чем одной ";" в конце — остаётся только поправить creator_id.
+    n_semicolons = sql.count(";")
+    if (
+        sql[:6].lower().startswith(("select", "with"))
+        and "`" not in sql
+        and (n_semicolons == 0 or (n_semicolons == 1 and sql.endswith(";")))
+    ):
+        return _CREATOR.sub(_repl_creator, sql)
+
+    if "`" in sql:
+        # убрать ```sql ``` обёртки
+        sql = _FENCE_OPEN.sub("", sql)
+        sql = _FENCE_CLOSE.sub("", sql)
 
-    # убрать одиночные backticks `...`
-    if sql.startswith("`") and sql.endswith("`"):
-        sql = sql[1:-1].strip()
+        # убрать одиночные backticks `...`
+        sql = _BACKTICKS.sub(r"\1", sql).strip()
 
     # убрать префиксы типа "SQL:"
-    sql = re.sub(r"^(SQL|Ответ)\s*:\s*", "", sql, flags=re.IGNORECASE).strip()
+    if sql[:1] in _PREFIX_FIRST_CHARS:
+        sql = _PREFIX.sub("", sql).strip()
 
     # если модель вернула несколько запросов — берём только первый
     if ";" in sql:
@@ -43,16 +95,7 @@ def sanitize_sql(sql: str) -> str:
         if first:
             sql = first + ";"
 
-    # Если встречается creator_id = 'что-то' и это НЕ UUID -> сравниваем как текст
-    def repl_creator(m):
-        val = m.group(1)
-        if UUID_RE.match(val):
-            return f"creator_id = '{val}'"
-        return f"creator_id::text = '{val}'"
-
-    sql = re.sub(r"creator_id\s*=\s*'([^']+)'", repl_creator, sql, flags=re.IGNORECASE)
-
-    return sql
+    return _CREATOR.sub(_repl_creator, sql)
 
 
 SCHEMA_DESCRIPTION = """
@@ -60,8 +103,13 @@ SCHEMA_DESCRIPTION = """
 
 ВАЖНО:
 - id, creator_id и video_id — UUID (строки вида xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx).
-- Если в вопросе указан id как число (например "42"), трактуй это как строку: creator_id = '42'.
-- Отвечай ТОЛЬКО SQL‑запросом. Никаких пояснений, списков, markdown, ``` или `...`.
+- Если в вопросе указан id как число (например "42"), передавай его строкой: "42".
+- Отвечай ТОЛЬКО JSON‑объектом вида {"sql": "...", "params": [...]}.
+  Никаких пояснений, списков, markdown, ``` или `...`.
+- Все значения из вопроса (id, даты, время) передавай в "params", а в SQL
+  ссылайся на них как $1, $2, ... В SQL не должно быть строк в кавычках '...'.
+- Даты передавай строкой "YYYY-MM-DD" и приводи в SQL как $N::date,
+  дату со временем — строкой "YYYY-MM-DD HH:MM" и приводи как $N::timestamptz.
 
 Таблица videos (итоговая статистика по ролику):
   id — UUID, идентификатор видео (первичный ключ)
@@ -90,25 +138,346 @@ SCHEMA_DESCRIPTION = """
 
 Запрос должен возвращать ОДНО числовое значение.
 
+Правила:
+- Итоговые значения (сколько просмотров/лайков у видео сейчас) бери из videos.
+- Прирост за период или за день считай как SUM(delta_*) по video_snapshots
+  с фильтром по video_snapshots.created_at.
+- Фильтр по дате публикации видео — по videos.video_created_at.
+- Для агрегатов, которые могут вернуть NULL, используй COALESCE(..., 0).
+- Период "с X по Y включительно" задавай как >= X и < (Y + 1 день).
+
 Примеры (без кавычек ` и без markdown):
 
 1) Сколько всего видео есть в системе?
-SELECT COUNT(*) FROM videos;
+{"sql": "SELECT COUNT(*) FROM videos;", "params": []}
 
 2) Сколько видео у креатора с id 42 вышло с 1 ноября 2025 по 5 ноября 2025 включительно?
-SELECT COUNT(*) FROM videos
-WHERE creator_id = '42'
-  AND video_created_at >= '2025-11-01'
-  AND video_created_at <= '2025-11-05 23:59:59';
+{"sql": "SELECT COUNT(*) FROM videos WHERE creator_id = $1 AND video_created_at >= $2::date AND video_created_at < $3::date + 1;", "params": ["42", "2025-11-01", "2025-11-05"]}
 
 3) На сколько просмотров в сумме выросли все видео 28 ноября 2025?
-SELECT COALESCE(SUM(delta_views_count),0)
-FROM video_snapshots
-WHERE DATE(created_at) = '2025-11-28';
+{"sql": "SELECT COALESCE(SUM(delta_views_count),0) FROM video_snapshots WHERE DATE(created_at) = $1::date;", "params": ["2025-11-28"]}
+
+4) Сколько всего замеров (снапшотов) есть в системе?
+{"sql": "SELECT COUNT(*) FROM video_snapshots;", "params": []}
+
+5) Сколько видео набрали больше 100 000 просмотров за всё время?
+{"sql": "SELECT COUNT(*) FROM videos WHERE views_count > $1;", "params": [100000]}
+
+6) Сколько просмотров у самого популярного видео?
+{"sql": "SELECT COALESCE(MAX(views_count),0) FROM videos;", "params": []}
+
+7) Сколько лайков в сумме набрали все видео креатора с id 42?
+{"sql": "SELECT COALESCE(SUM(likes_count),0) FROM videos WHERE creator_id = $1;", "params": ["42"]}
+
+8) Сколько разных креаторов опубликовали хотя бы одно видео в ноябре 2025?
+{"sql": "SELECT COUNT(DISTINCT creator_id) FROM videos WHERE video_created_at >= $1::date AND video_created_at < $2::date;", "params": ["2025-11-01", "2025-12-01"]}
+
+9) Какое среднее число просмотров у видео, опубликованных 10 ноября 2025?
+{"sql": "SELECT COALESCE(AVG(views_count),0) FROM videos WHERE DATE(video_created_at) = $1::date;", "params": ["2025-11-10"]}
+
+10) Сколько разных видео получали новые просмотры 27 ноября 2025?
+{"sql": "SELECT COUNT(DISTINCT video_id) FROM video_snapshots WHERE DATE(created_at) = $1::date AND delta_views_count > 0;", "params": ["2025-11-27"]}
+
+11) На сколько выросло число комментариев у видео креатора с id 42 с 1 по 3 ноября 2025 включительно?
+{"sql": "SELECT COALESCE(SUM(s.delta_comments_count),0) FROM video_snapshots s JOIN videos v ON v.id = s.video_id WHERE v.creator_id = $1 AND s.created_at >= $2::date AND s.created_at < $3::date + 1;", "params": ["42", "2025-11-01", "2025-11-03"]}
+
+12) Сколько жалоб в сумме получили все видео 28 ноября 2025 с 10:00 до 15:00?
+{"sql": "SELECT COALESCE(SUM(delta_reports_count),0) FROM video_snapshots WHERE created_at >= $1::timestamptz AND created_at < $2::timestamptz;", "params": ["2025-11-28 10:00", "2025-11-28 15:00"]}
+
+13) Сколько лайков набрали за 28 ноября 2025 видео, опубликованные в тот же день?
+{"sql": "SELECT COALESCE(SUM(s.delta_likes_count),0) FROM video_snapshots s JOIN videos v ON v.id = s.video_id WHERE DATE(v.video_created_at) = $1::date AND DATE(s.created_at) = $1::date;", "params": ["2025-11-28"]}
 """
 
+# Провайдеры (OpenAI, GigaChat) кешируют совпадающий префикс промпта, если он
+# длиннее ~1024 токенов. Поэтому системный промпт — неизменяемая константа без
+# подстановок, а вопрос пользователя всегда идёт отдельным последним сообщением.
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Ответ — один короткий JSON с SQL и параметрами (в примерах до ~90 токенов);
+# запас нужен, чтобы длинный запрос не обрезался посреди JSON
+LLM_MAX_TOKENS = 200
+
+# Шаблоны частых вопросов: SQL строится без обращения к LLM, значения из
+# вопроса (creator_id, даты) передаются параметрами $1, $2, ...
+_MONTHS = {
+    "января": 1, "февраля": 2, "марта": 3, "апреля": 4, "мая": 5, "июня": 6,
+    "июля": 7, "августа": 8, "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12,
+}
+_DATE = r"(\d{1,2})\s+(" + "|".join(_MONTHS) + r")\s+(\d{4})(?:\s*(?:года|г\.?))?"
+
+
+def _ru_date(day: str, month: str, year: str) -> date:
+    """Собирает дату из "28", "ноября", "2025"; ValueError для несуществующих дат."""
+    return date(int(year), _MONTHS[month.lower()], int(day))
+
+
+def _total_videos(m: re.Match) -> tuple[str, list[Any]]:
+    return "SELECT COUNT(*) FROM videos;", []
+
+
+def _creator_videos_between(m: re.Match) -> tuple[str, list[Any]]:
+    sql = (
+        "SELECT COUNT(*) FROM videos "
+        "WHERE creator_id = $1 "
+        "AND video_created_at >= $2::date "
+        "AND video_created_at < $3::date + 1;"
+    )
+    return sql, [m.group(1), _ru_date(*m.group(2, 3, 4)), _ru_date(*m.group(5, 6, 7))]
+
+
+def _views_growth_on_date(m: re.Match) -> tuple[str, list[Any]]:
+    sql = (
+        "SELECT COALESCE(SUM(delta_views_count),0) FROM video_snapshots "
+        "WHERE DATE(created_at) = $1::date;"
+    )
+    return sql, [_ru_date(*m.group(1, 2, 3))]
+
+
+TEMPLATES: list[tuple[re.Pattern, Callable[[re.Match], tuple[str, list[Any]]]]] = [
+    (
+        re.compile(
+            r"сколько\s+всего\s+видео(?:\s+есть)?(?:\s+в\s+системе)?\s*\??",
+            re.IGNORECASE,
+        ),
+        _total_videos,
+    ),
+    (
+        re.compile(
+            r"сколько\s+видео\s+у\s+креатора\s+(?:с\s+)?(?:id\s+)?([0-9A-Za-z-]+)\s+"
+            r"вышло\s+с\s+" + _DATE + r"\s+по\s+" + _DATE +
+            r"(?:\s+включительно)?\s*\??",
+            re.IGNORECASE,
+        ),
+        _creator_videos_between,
+    ),
+    (
+        re.compile(
+            r"на\s+сколько\s+просмотров\s+в\s+сумме\s+выросли\s+все\s+видео\s+"
+            + _DATE + r"\s*\??",
+            re.IGNORECASE,
+        ),
+        _views_growth_on_date,
+    ),
+]
+
+# Статистика попаданий в шаблоны — по ней видно, какие шаблоны стоит добавить
+_template_stats = {"hits": 0, "total": 0}
+
+
+def _match_template(question: str) -> Optional[tuple[str, list[Any]]]:
+    """Возвращает (sql, params) по первому подходящему шаблону или None."""
+    text = question.strip()
+    _template_stats["total"] += 1
+    for pattern, render in TEMPLATES:
+        m = pattern.fullmatch(text)
+        if m is None:
+            continue
+        try:
+            result = render(m)
+        except ValueError:  # например, "31 ноября"
+            continue
+        _template_stats["hits"] += 1
+        logger.info(
+            "Template hit: %s (%d/%d)",
+            render.__name__,
+            _template_stats["hits"],
+            _template_stats["total"],
+        )
+        return result
+    return None
+
+
+def check_prompt_prefix() -> None:
+    """Проверяет, что системный промпт попадает в кеш префиксов OpenAI.
+
+    Вызывается один раз при старте бота в отдельном потоке: tiktoken
+    синхронно скачивает словарь при первом обращении. Проверка не валит
+    бота, а лишь пишет предупреждение в лог.
+    """
+    if settings.llm_provider.lower().strip() != "openai":
+        return
+    model = settings.llm_model
+    try:
+        import tiktoken
+
+        n_tokens = len(tiktoken.encoding_for_model(model).encode(SCHEMA_DESCRIPTION))
+    except Exception:
+        logger.debug("Cannot count prompt tokens for %s", model, exc_info=True)
+        return
+    if n_tokens < PROMPT_CACHE_MIN_TOKENS:
+        logger.warning(
+            "System prompt is %d tokens, prefix caching needs >= %d",
+            n_tokens,
+            PROMPT_CACHE_MIN_TOKENS,
+        )
+
+
+def _check_finish_reason(choice) -> None:
+    """Логирует ответ, обрезанный по LLM_MAX_TOKENS: иначе он выглядит как
+    непонятная ошибка разбора JSON."""
+    if getattr(choice, "finish_reason", None) == "length":
+        logger.warning(
+            "LLM response truncated at max_tokens=%d: %r",
+            LLM_MAX_TOKENS,
+            choice.message.content,
+        )
+
+
+def _log_prompt_cache_usage(usage) -> None:
+    """Логирует, сколько токенов промпта провайдер взял из кеша."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    logger.info("LLM prompt tokens: %d (cached: %d)", usage.prompt_tokens, cached)
+
+
+# Клиенты LLM живут всё время работы бота: так переиспользуются
+# HTTPS‑соединения (keep-alive) и токен авторизации GigaChat.
+_openai_client: Optional[AsyncOpenAI] = None
+_gigachat_client: Optional[GigaChat] = None
+_gigachat_lock = asyncio.Lock()
+
+
+def _get_openai() -> AsyncOpenAI:
+    """Возвращает общий клиент OpenAI, создавая его при первом обращении."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
+    return _openai_client
+
+
+async def _get_gigachat() -> GigaChat:
+    """Возвращает общий клиент GigaChat, создавая его при первом обращении."""
+    global _gigachat_client
+    if _gigachat_client is not None:
+        return _gigachat_client
+
+    async with _gigachat_lock:
+        if _gigachat_client is None:
+            client_kwargs = {}
+            # Параметры GigaChat считываются из настроек.
+            if settings.gigachat_credentials:
+                client_kwargs["credentials"] = settings.gigachat_credentials
+            if settings.gigachat_scope:
+                client_kwargs["scope"] = settings.gigachat_scope
+            if settings.gigachat_model:
+                client_kwargs["model"] = settings.gigachat_model
+            if settings.gigachat_ca_bundle_file:
+                client_kwargs["ca_bundle_file"] = settings.gigachat_ca_bundle_file
+            if settings.gigachat_verify_ssl_certs is not None:
+                client_kwargs["verify_ssl_certs"] = settings.gigachat_verify_ssl_certs
+
+            client = GigaChat(**client_kwargs)
+            await client.__aenter__()
+            _gigachat_client = client
+    return _gigachat_client
+
+
+async def close_llm_clients() -> None:
+    """Закрывает общие клиенты LLM, если они были созданы."""
+    global _openai_client, _gigachat_client
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+    if _gigachat_client is not None:
+        await _gigachat_client.__aexit__(None, None, None)
+        _gigachat_client = None
+
+
+sql_cache = SemanticSQLCache(
+    settings.llm_cache_path,
+    model_name=settings.semantic_cache_model,
+    threshold=settings.semantic_cache_threshold,
+)
+
+
+@aioprof
+async def query_to_sql(question: str) -> tuple[str, list[Any]]:
+    """
+    Преобразует текст вопроса в SQL‑запрос.
+
+    Частые вопросы разбираются шаблонами `TEMPLATES` без обращения к LLM.
+    Остальные сначала ищутся в кеше `sql_cache` (точное и семантическое
+    совпадение), при промахе вопрос уходит в LLM, а результат кешируется.
 
-async def query_to_sql(question: str) -> str:
+    Возвращает:
+        Пару (sql, params): SQL с плейсхолдерами $1, $2, ... и значения
+        для них.
+    """
+    matched = _match_template(question)
+    if matched is not None:
+        return matched
+    payload = await sql_cache.get_or_create(question, _generate_sql)
+    return _decode_payload(payload)
+
+
+# Строковые литералы в SQL от LLM запрещены: значения идут только в params
+_STRING_LITERAL = re.compile(r"'[^']*'")
+# ... в том числе в долларовых кавычках: $$...$$, $tag$...$tag$
+_DOLLAR_QUOTE = re.compile(r"\$\w*\$")
+_PLACEHOLDER = re.compile(r"\$(\d+)")
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_ISO_DATETIME = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:\d{2})?"
+)
+
+
+def parse_llm_response(raw: str) -> tuple[str, list[Any]]:
+    """Разбирает ответ LLM вида {"sql": "...", "params": [...]}.
+
+    SQL проходит через `sanitize_sql` и проверяется: в нём не должно быть
+    строковых литералов (в том числе $$...$$), а плейсхолдеры $N должны
+    быть ровно $1..$len(params), без пропусков. Параметры допускаются только скалярные (str, int, float,
+    bool). При нарушении бросает ValueError — такой ответ не кешируется.
+    """
+    # Модель может обернуть JSON в ```json ... ``` или добавить текст вокруг
+    start, end = raw.find("{"), raw.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"LLM response is not a JSON object: {raw!r}")
+    obj = orjson.loads(raw[start:end + 1])
+
+    sql = obj.get("sql") if isinstance(obj, dict) else None
+    params = obj.get("params", []) if isinstance(obj, dict) else None
+    if not isinstance(sql, str) or not isinstance(params, list):
+        raise ValueError(f"LLM response has no sql/params: {raw!r}")
+
+    bad = [p for p in params if not isinstance(p, (str, int, float, bool))]
+    if bad:
+        raise ValueError(f"LLM returned params of unsupported types: {bad!r}")
+
+    sql = sanitize_sql(sql)
+    if _STRING_LITERAL.search(sql) or _DOLLAR_QUOTE.search(sql):
+        raise ValueError(f"LLM returned SQL with string literals: {sql}")
+    placeholders = {int(n) for n in _PLACEHOLDER.findall(sql)}
+    if placeholders != set(range(1, len(params) + 1)):
+        raise ValueError(
+            f"SQL placeholders {sorted(placeholders)} do not match {len(params)} params"
+        )
+    return sql, params
+
+
+def _coerce_param(value: Any) -> Any:
+    """Превращает строки с датой/временем в date/datetime для asyncpg."""
+    if isinstance(value, str):
+        if _ISO_DATE.fullmatch(value):
+            return date.fromisoformat(value)
+        if _ISO_DATETIME.fullmatch(value):
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+def _decode_payload(payload: str) -> tuple[str, list[Any]]:
+    """Достаёт (sql, params) из значения кеша; ValueError, если оно испорчено."""
+    try:
+        obj = orjson.loads(payload)
+        return obj["sql"], [_coerce_param(p) for p in obj["params"]]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Broken SQL cache entry: {payload!r}") from e
+
+
+@aioprof
+async def _generate_sql(question: str) -> str:
     """
     Преобразует текст вопроса в SQL‑запрос с помощью LLM.
 
@@ -116,51 +485,47 @@ async def query_to_sql(question: str) -> str:
         question: текст сообщения от пользователя на русском.
 
     Возвращает:
-        Строку с SQL‑запросом. В запросе не должно быть комментариев или
-        постороннего текста. Предполагается, что он возвращает одно число.
+        JSON‑строку {"sql": "...", "params": [...]} — в таком виде результат
+        хранится в `sql_cache`. SQL уже проверен `parse_llm_response` и
+        возвращает одно число.
     """
     provider = settings.llm_provider.lower().strip()
 
     if provider == "openai":
-        # Для openai v1 API создаём клиент и отправляем запрос.
-        openai.api_key = settings.openai_api_key
+        client = _get_openai()
         messages = [
             {"role": "system", "content": SCHEMA_DESCRIPTION},
             {"role": "user", "content": question.strip()},
         ]
-        response = await openai.ChatCompletion.acreate(
+        response = await client.chat.completions.create(
             model=settings.llm_model,
             messages=messages,
-            temperature=0.0,
-            max_tokens=200,
+            temperature=settings.llm_temperature,
+            top_p=settings.llm_top_p,
+            max_tokens=LLM_MAX_TOKENS,
         )
-        raw = response.choices[0].message["content"]
-        return sanitize_sql(raw)
+        _log_prompt_cache_usage(response.usage)
+        _check_finish_reason(response.choices[0])
+        raw = response.choices[0].message.content or ""
+        return _encode_payload(*parse_llm_response(raw))
 
     if provider == "gigachat":
         chat = Chat(
             messages=[
                 Messages(role=MessagesRole.SYSTEM, content=SCHEMA_DESCRIPTION),
                 Messages(role=MessagesRole.USER, content=question.strip()),
-            ]
+            ],
+            max_tokens=LLM_MAX_TOKENS,
         )
 
-        client_kwargs = {}
-        # Параметры GigaChat считываются из настроек.
-        if settings.gigachat_credentials:
-            client_kwargs["credentials"] = settings.gigachat_credentials
-        if settings.gigachat_scope:
-            client_kwargs["scope"] = settings.gigachat_scope
-        if settings.gigachat_model:
-            client_kwargs["model"] = settings.gigachat_model
-        if settings.gigachat_ca_bundle_file:
-            client_kwargs["ca_bundle_file"] = settings.gigachat_ca_bundle_file
-        if settings.gigachat_verify_ssl_certs is not None:
-            client_kwargs["verify_ssl_certs"] = settings.gigachat_verify_ssl_certs
-
-        async with GigaChat(**client_kwargs) as client:
-            response = await client.achat(chat)
-            raw = response.choices[0].message.content
-            return sanitize_sql(raw)
-
-    raise ValueError(f"Unknown LLM provider: {settings.llm_provider}")
\ No newline at end of file
+        client = await _get_gigachat()
+        response = await client.achat(chat)
+        _check_finish_reason(response.choices[0])
+        raw = response.choices[0].message.content
+        return _encode_payload(*parse_llm_response(raw))
+
+    raise ValueError(f"Unknown LLM provider: {settings.llm_provider}")
+
+
+def _encode_payload(sql: str, params: list[Any]) -> str:
+    return orjson.dumps({"sql": sql, "params": params}).decode()
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""Лёгкий профилировщик горячих функций бота.
+
+Декоратор `aioprof` копит для функции (синхронной или корутины) число
+вызовов, суммарное и максимальное время выполнения. Накладные расходы —
+два вызова `time.perf_counter_ns()` на вызов, поэтому он включён всегда, а
+в режиме отладки (`BOT_DEBUG`) статистику можно посмотреть командой
+`/stats` или сигналом SIGUSR1.
+"""
+
+from __future__ import annotations
+
+import functools
+import inspect
+import time
+from typing import Any, Callable, TypeVar
+
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# имя функции -> [число вызовов, суммарное время, максимальное время] в нс
+stats: dict[str, list[int]] = {}
+
+
+def _record(name: str, elapsed: int) -> None:
+    entry = stats.get(name)
+    if entry is None:
+        stats[name] = [1, elapsed, elapsed]
+        return
+    entry[0] += 1
+    entry[1] += elapsed
+    if elapsed > entry[2]:
+        entry[2] = elapsed
+
+
+def aioprof(func: F) -> F:
+    """Оборачивает функцию и учитывает время её выполнения в `stats`.
+
+    Для корутин время считается от начала до конца `await`, то есть
+    включает ожидание сети и БД.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter_ns()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter_ns() - start)
+
+        return async_wrapper  # type: ignore[return-value]
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter_ns() - start)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def format_stats() -> str:
+    """Возвращает накопленную статистику текстом, самые затратные — сверху."""
+    if not stats:
+        return "Статистика пока пуста."
+    lines = []
+    for name, (calls, total, peak) in sorted(
+        stats.items(), key=lambda item: item[1][1], reverse=True
+    ):
+        lines.append(
+            f"{name}: {calls} вызовов, всего {total / 1e6:.1f} мс, "
+            f"в среднем {total / calls / 1e6:.2f} мс, максимум {peak / 1e6:.1f} мс"
+        )
+    return "\n".join(lines)